@@ -4,14 +4,33 @@
 N.B. Implementation functions have a `_` prefix. Public functions do not. Don't worry to much about it. Just use the prefix-less versions when playing around, as they have all the debug niceties.
 """
 import re
+import os
+import sys
+import mmap
+import struct
+import random
+import hashlib
+import binascii
+import tempfile
 import collections
 import contextlib
 import logging
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__version__ = '0.2.1'
+
 logger = logging.getLogger('nock')
+logger.addHandler(logging.NullHandler())
 DEFAULT_LEVEL = logger.getEffectiveLevel()
 __all__ = ['YES', 'NO', 'fas', 'lus', 'nock', 'tar', 'tis', 'wut',
-           'debug']
+           'debug', 'cord', 'uncord', 'write_cord', 'tape', 'untape',
+           'size', 'compact', 'NounStore', 'prepare', 'tar_batch', 'jam', 'cue',
+           'recording', 'replay', 'diff_traces', 'jet', 'verified', 'parallel',
+           'NockCrash', 'strict', 'parse', 'evaluate']
 
 """
 1 Structures
@@ -109,20 +128,77 @@ Line 2:
 """
 
 
-def _aorc(a):
+def _aorc(a, depth=0):
     """Return an atom or a properly structured cell.
 
     >>> _aorc(1)
     1
     >>> _aorc((1, 2))
     (1, 2)
+    >>> _aorc([1, [2, 3, 4]])
+    (1, (2, (3, 4)))
+    >>> n = _aorc([7] * 5000)
+    >>> size(n).nodes, _aorc(n) is n
+    (9999, True)
     """
-    if isinstance(a, collections.Iterable):
-        return _t(*a)
+    if isinstance(a, StoredCell):
+        return a
+    elif depth > _AORC_DEPTH and isinstance(a, collections.Iterable):
+        return _aorc_deep(a)
+    elif isinstance(a, tuple) and len(a) == 2:
+        # Keep cells that are already properly structured, so that nouns
+        # keep their identity (and their sharing) as they pass through.
+        h, t = _aorc(a[0], depth + 1), _aorc(a[1], depth + 1)
+        return a if h is a[0] and t is a[1] else (h, t)
+    elif isinstance(a, collections.Iterable):
+        items = list(a)
+        cell = _aorc(items.pop(), depth + 1) if len(items) > 1 else 0
+        while items:
+            cell = (_aorc(items.pop(), depth + 1), cell)
+        return cell
     else:
         return a
 
 
+# Past this depth, `_aorc` carries on with an explicit stack instead.
+_AORC_DEPTH = 100
+
+
+def _aorc_deep(a):
+    """Like `_aorc`, but walks the noun without recursion, for deep nouns.
+    """
+    done = {}
+    kids = {}
+    stack = [a]
+    while stack:
+        n = stack[-1]
+        if id(n) in done:
+            stack.pop()
+            continue
+        if (isinstance(n, (StoredCell, basestring))
+                or not isinstance(n, collections.Iterable)):
+            done[id(n)] = n
+            stack.pop()
+            continue
+        if id(n) not in kids:
+            kids[id(n)] = (n, list(n))
+        children = kids[id(n)][1]
+        pending = [c for c in children if id(c) not in done]
+        if pending:
+            stack.extend(reversed(pending))
+            continue
+        stack.pop()
+        children = [done[id(c)] for c in children]
+        if isinstance(n, tuple) and len(n) == 2:
+            done[id(n)] = n if children[0] is n[0] and children[1] is n[1] else tuple(children)
+        else:
+            cell = children.pop() if len(children) > 1 else 0
+            while children:
+                cell = (children.pop(), cell)
+            done[id(n)] = cell
+    return done[id(a)]
+
+
 def _t(*lst):
     """Properly structure an improper list.
 
@@ -139,13 +215,7 @@ def _t(*lst):
     >>> _t(42, ((4, 0, 1), (3, 0, 1)))
     (42, ((4, (0, 1)), (3, (0, 1))))
     """
-    if len(lst) == 1:
-        return (_aorc(lst[0]), 0)
-    elif len(lst) == 2:
-        a, b = lst
-        return (_aorc(a), _aorc(b))
-    else:
-        return (_aorc(lst[0]), _t(*lst[1:]))
+    return _aorc(lst)
 
 
 """
@@ -182,6 +252,10 @@ We should note that in Nock and Hoon, `0` (pronounced “yes”) is true, and `1
 YES = 0
 NO  = 1
 
+# An atom is any natural number, and Python 2 quietly promotes the big ones to
+# `long`.
+ATOM = (int, long)
+
 
 def _wut(noun):
     """? :: Test whether a noun is a cell or an atom.
@@ -194,7 +268,7 @@ def _wut(noun):
     >>> wut(1)
     1
     """
-    return NO if isinstance(noun, int) else YES
+    return NO if isinstance(noun, ATOM) else YES
 
 
 def _lus(noun):
@@ -208,7 +282,9 @@ def _lus(noun):
     >>> lus(1)
     2
     """
-    return (1 + noun) if isinstance(noun, int) else noun
+    if STRICT and not isinstance(noun, ATOM):
+        raise NockCrash("+[a b] never terminates")
+    return (1 + noun) if isinstance(noun, ATOM) else noun
 
 
 def _tis(noun):
@@ -222,6 +298,8 @@ def _tis(noun):
     >>> tis((1, 0))
     1
     """
+    if STRICT and isinstance(noun, ATOM):
+        raise NockCrash("=%s never terminates" % noun)
     return YES if noun[0] == noun[1] else NO
 
 
@@ -290,6 +368,8 @@ def _fas((n, noun)):
     (14, 15)
     """
     noun = _aorc(noun)
+    if STRICT and (not isinstance(n, ATOM) or n < 1):
+        raise NockCrash("/[%s a]: no such axis" % _r(n))
     try:
         if n == 1:
             return noun
@@ -304,6 +384,8 @@ def _fas((n, noun)):
         else:
             return noun
     except TypeError:
+        if STRICT:
+            raise NockCrash("/[%s %s]: an atom has no %s" % (n, noun, 'head' if n == 2 else 'tail'))
         return noun
 
 
@@ -571,6 +653,24 @@ OP_H08 = 8
 OP_H09 = 9
 OP_H10 = 10
 
+# The reductions of `*`, by line number.
+SPEC = {
+    19: "19 ::    *[a [b c] d]      [*[a b c] *[a d]]",
+    21: "21 ::    *[a 0 b]          /[b a]",
+    22: "22 ::    *[a 1 b]          b",
+    23: "23 ::    *[a 2 b c]        *[*[a b] *[a c]]",
+    24: "24 ::    *[a 3 b]          ?*[a b]",
+    25: "25 ::    *[a 4 b]          +*[a b]",
+    26: "26 ::    *[a 5 b]          =*[a b]",
+    28: "28 ::    *[a 6 b c d]      *[a 2 [0 1] 2 [1 c d] [1 0] 2 [1 2 3] [1 0] 4 4 b]",
+    29: "29 ::    *[a 7 b c]        *[a 2 b 1 c]",
+    30: "30 ::    *[a 8 b c]        *[a 7 [[7 [0 1] b] 0 1] c]",
+    31: "31 ::    *[a 9 b c]        *[a 7 c 2 [0 1] 0 b]",
+    32: "32 ::    *[a 10 [b c] d]   *[a 8 c 7 [0 3] d]",
+    33: "33 ::    *[a 10 b c]       *[a c]",
+    35: "35 ::    *a                *a",
+}
+
 
 def _tar(noun):
     """*[a, b] -- Reduce a Nock expression.
@@ -629,50 +729,66 @@ def _tar(noun):
     >>> tar((42, (8, (4, 0, 1), (4, 0, 3))))
     43
 
+    ## 32 ::    *[a 10 [b c] d]   *[a 8 c 7 [0 3] d]
+    >>> tar(((132, 19), (10, (37, (4, 0, 3)), (4, 0, 3))))
+    20
+
     ## 33 ::    *[a 10 b c]       *[a c]
     >>> tar(((132, 19), (10, 37, (4, 0, 3))))
     20
     """
+    global REDUCTIONS
+    REDUCTIONS += 1
+    if STRICT and isinstance(noun, ATOM):
+        raise NockCrash("*%s never terminates" % noun)
     noun = _t(*noun)
     # Let's use `_fas` to carve up the noun, for practice.
     subj = _fas((2, noun))  # noun[0]
+    formula = _fas((3, noun))  # noun[1]
+    if STRICT and isinstance(formula, ATOM):
+        raise NockCrash("*[a %s] never terminates" % formula)
     op = _fas((6, noun))  # noun[1][0]
     obj = _fas((7, noun))  # noun[1][1]
+    if JETS and formula in JETS:
+        with _indent():
+            return JETS[formula](subj)
     with _indent():
         if _wut(op) == YES:
-            _d("<- 19 ::    *[a [b c] d]      [*[a b c] *[a d]]")
+            _fire(19, subj, formula)
             with _indent():
+                if PARALLEL is not None:
+                    return PARALLEL.autocons(subj, op, obj)
                 return (tar((subj, op)), tar((subj, obj)))
         else:
             if op == OP_FAS:
-                _d("<- 21 ::    *[a 0 b]          /[b a]")
+                _fire(21, subj, formula)
                 return fas((obj, subj))
 
             elif op == OP_CON:
-                _d("<- 22 ::    *[a 1 b]          b")
+                _fire(22, subj, formula)
                 return obj
 
             elif op == OP_TAR:
-                _d("<- 23 ::    *[a 2 b c]        *[*[a b] *[a c]]")
+                _fire(23, subj, formula)
                 b = _fas((2, obj))
                 c = _fas((3, obj))
                 with _indent():
                     return tar((tar((subj, b)), tar((subj, c))))
 
             elif op == OP_WUT:
-                _d("<- 24 ::    *[a 3 b]          ?*[a b]")
+                _fire(24, subj, formula)
                 return wut(tar((subj, obj)))
 
             elif op == OP_LUS:
-                _d("<- 25 ::    *[a 4 b]          +*[a b]")
+                _fire(25, subj, formula)
                 return lus(tar((subj, obj)))
 
             elif op == OP_TIS:
-                _d("<- 26 ::    *[a 5 b]          =*[a b]")
+                _fire(26, subj, formula)
                 return tis(tar((subj, obj)))
 
             elif op == OP_IF:
-                _d("<- 28 ::    *[a 6 b c d]      *[a 2 [0 1] 2 [1 c d] [1 0] 2 [1 2 3] [1 0] 4 4 b]")
+                _fire(28, subj, formula)
                 a = subj
                 b = _fas((2, obj))
                 c = _fas((6, obj))
@@ -681,21 +797,21 @@ def _tar(noun):
                     return tar((a, 2, (0, 1), 2, (1, c, d), (1, 0), 2, (1, 2, 3), (1, 0), 4, 4, b))
 
             elif op == OP_H07:
-                _d("<- 29 ::    *[a 7 b c]        *[a 2 b 1 c]")
+                _fire(29, subj, formula)
                 b = _fas((2, obj))
                 c = _fas((3, obj))
                 with _indent():
                     return tar((subj, 2, b, 1, c))
 
             elif op == OP_H08:
-                _d("<- 30 ::    *[a 8 b c]        *[a 7 [[7 [0 1] b] 0 1] c]")
+                _fire(30, subj, formula)
                 b = _fas((2, obj))
                 c = _fas((3, obj))
                 with _indent():
                     return tar((subj, 7, ((7, (0, 1), b), 0, 1), c))
 
             elif op == OP_H09:
-                _d("<- 31 ::    *[a 9 b c]        *[a 7 c 2 [0 1] 0 b]")
+                _fire(31, subj, formula)
                 b = _fas((2, obj))
                 c = _fas((3, obj))
                 with _indent():
@@ -704,16 +820,20 @@ def _tar(noun):
             elif op == OP_H10:
                 hint = _fas((2, obj))
                 if _wut(hint) == YES:
-                    _d("<- 32 ::    *[a 10 [b c] d]   *[a 8 c 7 [0 3] d]")
-                    c = _fas((2, hint))
+                    _fire(32, subj, formula)
+                    c = _fas((3, hint))
+                    d = _fas((3, obj))
                     with _indent():
-                        return tar((subj, 8, c, 7, (0, 3), obj))
+                        return tar((subj, 8, c, 7, (0, 3), d))
                 else:
-                    _d("<- 33 ::    *[a 10 b c]       *[a c]")
+                    _fire(33, subj, formula)
                     c = _fas((3, obj))
                     with _indent():
                         return tar((subj, c))
 
+            elif STRICT:
+                raise NockCrash("*[a %s b] never terminates: no such opcode" % op)
+
 
 ### HELPERS, because WE NEED HELP.
 ##################################
@@ -723,21 +843,26 @@ def _r(noun):
     >>> _r((42, 0, 1))
     '[42 0 1]'
     """
-    if isinstance(noun, int):
-        return repr(noun)
+    if isinstance(noun, ATOM):
+        return str(noun)
     else:
         return '[%s]' % ' '.join(_r(i) for i in noun)
 
 
 DEBUG_LEVEL = 0
+PEAK_LEVEL = 0
+REDUCTIONS = 0
+BATCHED = 0  # batches reduced on NumPy, which `REDUCTIONS` doesn't see
+RECORDER = None
 
 
 @contextlib.contextmanager
 def _indent():
     """Context manager to raise and lower the debug output indentation level.
     """
-    global DEBUG_LEVEL
+    global DEBUG_LEVEL, PEAK_LEVEL
     DEBUG_LEVEL += 1
+    PEAK_LEVEL = max(PEAK_LEVEL, DEBUG_LEVEL)
     try:
         yield
     finally:
@@ -752,12 +877,58 @@ def _d(*args):
     return logger.debug(a, *args[1:])
 
 
-def _public(original_func, formatter):
+def _fire(line, subj, formula):
+    """Note that the given line of the spec is reducing `*[subj formula]`.
+    """
+    if RECORDER is not None:
+        RECORDER.record(line, DEBUG_LEVEL, subj, formula)
+    _d("<- " + SPEC[line])
+
+
+def _whence(noun):
+    """Return the spec line reducing a noun, and a label for it, if any.
+
+    >>> _whence((42, (0, 7)))
+    (21, '/7')
+    >>> _whence((42, (10, (1953718630, (1, 0)), (0, 1))))
+    (32, '%fast')
+    """
+    try:
+        op, obj = _t(*noun)[1]
+    except (TypeError, ValueError):
+        return 35, None
+    if not isinstance(op, ATOM):
+        return 19, None
+    elif op == OP_FAS:
+        return 21, '/%s' % _r(obj)
+    elif op in (OP_H09, OP_H10) and isinstance(obj, ATOM):
+        return (31 if op == OP_H09 else 32), None
+    elif op == OP_H09:
+        return 31, '/%s' % _r(obj[0])
+    elif op == OP_H10:
+        hint = obj[0]
+        line, hint = (33, hint) if isinstance(hint, ATOM) else (32, hint[0])
+        if not isinstance(hint, ATOM):
+            return line, None
+        text = uncord(hint)
+        return line, ('%' + text) if text and re.match(r'^[a-z0-9-]+$', text) else str(hint)
+    return {OP_CON: 22, OP_TAR: 23, OP_WUT: 24, OP_LUS: 25, OP_TIS: 26, OP_IF: 28,
+            OP_H07: 29, OP_H08: 30}.get(op, 35), None
+
+
+def _public(original_func, formatter, whence=None):
     """Create a public interface w/ debug warts.
     """
     def wrapper(noun):
-        _d(formatter, _r(noun))
-        result = original_func(noun)
+        try:
+            if not logger.isEnabledFor(logging.DEBUG):
+                return original_func(noun)
+            _d(formatter, _r(noun))
+            result = original_func(noun)
+        except NockCrash as crash:
+            if whence is not None:
+                crash.frames.append(whence(noun))
+            raise
         with _indent():
             _d(_r(result))
         return result
@@ -771,7 +942,7 @@ wut = _public(_wut, '?%s')
 lus = _public(_lus, '+%s')
 tis = _public(_tis, '=%s')
 fas = _public(_fas, '/%s')
-tar = _public(_tar, '*%s')
+tar = _public(_tar, '*%s', _whence)
 
 
 def nock(n):
@@ -784,13 +955,10 @@ def nock(n):
     >>> nock('*[2 0 1]')
     2
     """
-    expr = n
     if isinstance(n, basestring):
-        expr = parse(n)
-        if n.startswith('*'):
-            return expr
+        return evaluate(_parsed(n if n.startswith('*') else '*' + n))
 
-    return tar(expr)
+    return tar(n)
 
 
 def debug(on=True):
@@ -808,6 +976,902 @@ def debug(on=True):
         logger.setLevel(DEFAULT_LEVEL)
 
 
+### SIZES, or: how big is that subject, really?
+###############################################
+"""
+Nock can't build cycles, but it shares subtrees all the time: `[8 b c]` pairs a
+new product with the *same* old subject, over and over. A subject that prints
+as gigabytes may only be a few thousand distinct cells. So we walk each
+distinct cell once (by identity), and compute the logical figures from those.
+"""
+NounSize = collections.namedtuple('NounSize', 'nodes cells bits heap')
+
+
+def _key(cell):
+    """Return a key that identifies a cell for as long as its noun lives.
+
+    Tuples are keyed by identity. A `StoredCell` is a new wrapper on every
+    access, so it is keyed by its store and offset instead.
+    """
+    if isinstance(cell, StoredCell):
+        return cell.store, cell.offset
+    return id(cell)
+
+
+def _cells(noun, known=()):
+    """Yield each distinct cell of a noun exactly once, children first.
+
+    Cells whose keys are in `known`, and everything beneath them, are skipped.
+    """
+    seen = set()
+    stack = [noun]
+    while stack:
+        n = stack[-1]
+        if isinstance(n, ATOM) or _key(n) in seen or _key(n) in known:
+            stack.pop()
+            continue
+        pending = [c for c in (n[1], n[0])
+                   if not isinstance(c, ATOM) and _key(c) not in seen and _key(c) not in known]
+        if pending:
+            stack.extend(pending)
+        else:
+            stack.pop()
+            seen.add(_key(n))
+            yield n
+
+
+def size(noun):
+    """Account for the size of a properly structured noun.
+
+    Returns a `NounSize` of:
+
+    - `nodes`: the number of atoms and cells in the noun as a tree,
+    - `cells`: the number of distinct cells actually in memory,
+    - `bits`: the total bit length of every atom in the tree,
+    - `heap`: an estimate, in bytes, of the Python objects behind the noun.
+
+    Runs in time linear in the number of distinct cells.
+
+    >>> size((42, (0, 1)))  # doctest: +ELLIPSIS
+    NounSize(nodes=5, cells=2, bits=7, heap=...)
+    >>> a = (1, 2)
+    >>> b = (a, a)
+    >>> c = (b, b)
+    >>> size((c, c))[:3]
+    (31, 4, 24)
+    """
+    def atom(a):
+        heap[id(a)] = a
+        return 1, a.bit_length()
+
+    heap = {}
+    tally = {}
+    for cell in _cells(noun):
+        heap[_key(cell)] = cell
+        h, t = [tally[_key(c)] if _key(c) in tally else atom(c) for c in cell]
+        tally[_key(cell)] = (1 + h[0] + t[0], h[1] + t[1])
+    nodes, bits = tally[_key(noun)] if _key(noun) in tally else atom(noun)
+    return NounSize(nodes, len(tally), bits, sum(sys.getsizeof(n) for n in heap.itervalues()))
+
+
+def compact(noun):
+    """Return an equal noun in which all equal subtrees are shared.
+
+    Tuples can't be changed in place, so this builds the deduplicated noun
+    bottom-up, reusing a single cell for every distinct value.
+
+    >>> n = compact(((1, 2), (1, 2)))
+    >>> n
+    ((1, 2), (1, 2))
+    >>> n[0] is n[1]
+    True
+    >>> size(n).cells
+    2
+    """
+    if isinstance(noun, ATOM):
+        return noun
+    canon = {}
+    memo = {}
+    for cell in _cells(noun):
+        h, t = [c if isinstance(c, ATOM) else memo[_key(c)] for c in cell]
+        key = tuple(c if isinstance(c, ATOM) else (id(c),) for c in (h, t))
+        if key not in canon:
+            canon[key] = (h, t)
+        memo[_key(cell)] = canon[key]
+    return memo[_key(noun)]
+
+
+### CORDS and TAPES, or: strings are atoms too.
+###############################################
+"""
+Remember "foo" becoming 0x6f6f66? That's a cord: the bytes of a string packed
+into a single atom, LSB first. A tape is the same text as a Nock list of
+single-byte atoms, one cell per character, terminated with 0.
+
+Packing a string into an atom one character at a time is quadratic in Python,
+so we let `binascii` do the bulk work: reverse the bytes, hexlify them, and
+hand the whole lot to `long()` in one go.
+"""
+
+
+def _bytes(s):
+    """Return the raw bytes of a string, buffer, or memoryview.
+    """
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    elif isinstance(s, memoryview):
+        return s.tobytes()
+    elif isinstance(s, (str, bytearray, buffer, mmap.mmap)):
+        return bytes(s)
+    raise TypeError("Expected a string or buffer, not %s." % type(s).__name__)
+
+
+def cord(s):
+    """Pack a string into an atom, LSB first.
+
+    >>> hex(cord('foo'))
+    '0x6f6f66'
+    >>> cord(memoryview(b'foo')) == cord(bytearray(b'foo')) == cord(u'foo')
+    True
+    >>> cord('')
+    0
+    >>> cord(5)
+    Traceback (most recent call last):
+        ...
+    TypeError: Expected a string or buffer, not int.
+    """
+    s = _bytes(s)
+    if not s:
+        return 0
+    return int(binascii.hexlify(s[::-1]), 16)
+
+
+def _hex(atom):
+    """Return the given atom as an even-length hex string, MSB first.
+    """
+    h = '%x' % atom
+    return ('0' + h) if len(h) % 2 else h
+
+
+def uncord(atom):
+    """Unpack an atom into a string, LSB first.
+
+    >>> uncord(0x6f6f66)
+    'foo'
+    >>> uncord(cord('Nock, Nock.'))
+    'Nock, Nock.'
+    >>> uncord(0)
+    ''
+    """
+    if not atom:
+        return ''
+    return binascii.unhexlify(_hex(atom))[::-1]
+
+
+def write_cord(atom, f, chunk_size=1 << 20):
+    """Write an atom to a file as a string, `chunk_size` bytes at a time.
+
+    Returns the number of bytes written.
+
+    >>> import io
+    >>> out = io.BytesIO()
+    >>> write_cord(cord('hello, world'), out, chunk_size=5)
+    12
+    >>> out.getvalue()
+    'hello, world'
+    """
+    h = _hex(atom) if atom else ''
+    end = len(h)
+    step = 2 * chunk_size
+    while end > 0:
+        start = max(0, end - step)
+        f.write(binascii.unhexlify(h[start:end])[::-1])
+        end = start
+    return len(h) // 2
+
+
+def tape(s):
+    """Convert a string into a null-terminated list of byte atoms.
+
+    >>> tape('foo')
+    (102, (111, (111, 0)))
+    >>> tape('')
+    0
+    """
+    noun = 0
+    for c in reversed(bytearray(_bytes(s))):
+        noun = (c, noun)
+    return noun
+
+
+def untape(noun):
+    """Convert a null-terminated list of byte atoms into a string.
+
+    >>> untape((102, (111, (111, 0))))
+    'foo'
+    >>> untape(tape('Nock, Nock.'))
+    'Nock, Nock.'
+    """
+    out = bytearray()
+    while noun != 0:
+        c, noun = noun
+        out.append(c)
+    return bytes(out)
+
+
+### JAM and CUE, the standard way to turn a noun into one atom.
+###############################################################
+"""
+`jam` writes a noun out as a stream of bits, LSB first, and packs the stream
+into an atom; `cue` reads it back. Each noun is a tag and a body:
+
+    0 <mat atom>                an atom
+    1 0 <jam head> <jam tail>   a cell
+    1 1 <mat position>          a noun we already wrote, at that bit position
+
+where `mat` is a self-delimiting length-prefixed atom. These are bit for bit
+the encodings Urbit uses, so jammed nouns travel between implementations.
+"""
+
+
+def _bits(value, width):
+    """Return the low `width` bits of an atom, MSB first, as a '0'/'1' string.
+    """
+    return format(value, '0%db' % width) if width else ''
+
+
+def _mat(a, out):
+    """Append the `mat` encoding of an atom to `out`; return its length.
+    """
+    if a == 0:
+        out.append('1')
+        return 1
+    b = a.bit_length()
+    c = b.bit_length()
+    out.append(_bits(1 << c, c + 1))
+    out.append(_bits(b & ((1 << (c - 1)) - 1), c - 1))
+    out.append(_bits(a, b))
+    return 2 * c + b
+
+
+def jam(noun):
+    """Serialize a noun into an atom.
+
+    >>> jam(0), jam(1), jam((0, 0)), jam((1, 2))
+    (2, 12, 41, 4657)
+    >>> cue(jam(((1, 2), (1, 2))))
+    ((1, 2), (1, 2))
+    """
+    out = []
+    pos = 0
+    seen = {}
+    stack = [compact(_aorc(noun))]
+    while stack:
+        n = stack.pop()
+        key = n if isinstance(n, ATOM) else (id(n),)
+        if key in seen:
+            if isinstance(n, ATOM) and n.bit_length() <= seen[key].bit_length():
+                out.append('0')
+                pos += 1 + _mat(n, out)
+            else:
+                out.append('11')
+                pos += 2 + _mat(seen[key], out)
+            continue
+        seen[key] = pos
+        if isinstance(n, ATOM):
+            out.append('0')
+            pos += 1 + _mat(n, out)
+        else:
+            out.append('01')
+            pos += 2
+            stack.append(n[1])
+            stack.append(n[0])
+    out.reverse()
+    return int(''.join(out), 2)
+
+
+def cue(atom):
+    """Deserialize an atom made by `jam`.
+
+    >>> cue(12)
+    1
+    >>> cue(jam(tape('foo')))
+    (102, (111, (111, 0)))
+    """
+    bits = bin(atom)[:1:-1] if atom else ''
+
+    def rub(pos):
+        end = bits.find('1', pos)
+        if end < 0:
+            raise ValueError("Malformed jam: unterminated length at bit %s" % pos)
+        c = end - pos
+        if c == 0:
+            return 0, 1
+        b = int('1' + bits[end + 1:end + c][::-1], 2)
+        start = end + c
+        return int(bits[start:start + b][::-1] or '0', 2), 2 * c + b
+
+    memo = {}
+    done = []
+    todo = [(0, 0)]
+    while todo:
+        pos, phase = todo.pop()
+        if phase == 1:
+            todo.append((pos, 2))
+            todo.append((pos + 2 + done[-1][1], 0))
+        elif phase == 2:
+            t, tw = done.pop()
+            h, hw = done.pop()
+            memo[pos] = (h, t)
+            done.append((memo[pos], 2 + hw + tw))
+        elif bits[pos:pos + 1] != '1':
+            a, w = rub(pos + 1)
+            memo[pos] = a
+            done.append((a, 1 + w))
+        elif bits[pos + 1:pos + 2] != '1':
+            todo.append((pos, 1))
+            todo.append((pos + 2, 0))
+        else:
+            ref, w = rub(pos + 2)
+            if ref not in memo:
+                raise ValueError("Malformed jam: bad reference at bit %s" % pos)
+            done.append((memo[ref], 2 + w))
+    return done[0][0]
+
+
+### The NOUN STORE, for sharing one big subject among many processes.
+####################################################################
+"""
+Pickling a subject for every task rebuilds it, tuple by tuple, on the far
+side. Instead, we can serialize a noun once into a flat buffer (an mmap'd
+file, or any other buffer, such as a `multiprocessing.shared_memory` block)
+and read cells and atoms out of it lazily, as the reduction touches them.
+
+The layout is a 16-byte header (magic, format version, root offset), then
+records, children before parents:
+
+    'a' <length:Q> <bytes, LSB first>      an atom
+    'c' <head:Q> <tail:Q>                  a cell, by record offset
+
+The noun is compacted on the way in, so within one store equal nouns always
+live at the same offset.
+"""
+STORE_MAGIC = b'NOCK'
+STORE_VERSION = 1
+_HEADER = struct.Struct('<4sB3xQ')
+_ATOM = struct.Struct('<cQ')
+_CELL = struct.Struct('<cQQ')
+_STORES = {}
+
+
+class StoredCell(object):
+    """A cell read lazily out of a `NounStore`.
+
+    It iterates, indexes, compares and hashes like the equivalent tuple.
+    """
+    __slots__ = ('store', 'offset')
+
+    def __init__(self, store, offset):
+        self.store = store
+        self.offset = offset
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        if i not in (0, 1, -1, -2):
+            raise IndexError(i)
+        return self.store._noun(_CELL.unpack_from(self.store.buf, self.offset)[1 + i % 2])
+
+    def __iter__(self):
+        _, h, t = _CELL.unpack_from(self.store.buf, self.offset)
+        yield self.store._noun(h)
+        yield self.store._noun(t)
+
+    def __eq__(self, other):
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if isinstance(a, StoredCell) and isinstance(b, StoredCell) and a.store is b.store:
+                if a.offset != b.offset:
+                    return False
+            elif isinstance(a, ATOM) or isinstance(b, ATOM):
+                if not (isinstance(a, ATOM) and isinstance(b, ATOM) and a == b):
+                    return False
+            elif len(b) != 2:
+                return False
+            else:
+                stack.extend(zip(a, b))
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+    def __reduce__(self):
+        if self.store.path is None:
+            return (tuple, (tuple(self),))
+        return (_stored, (self.store.path, self.offset))
+
+
+def _stored(path, offset):
+    """Unpickle a `StoredCell`, opening its store at most once per process.
+    """
+    return StoredCell(NounStore.open(path), offset)
+
+
+class NounStore(object):
+    """A read-only noun serialized in a flat buffer.
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp()
+    >>> NounStore.write(((4, 5), (6, 14, 15)), path)
+    >>> store = NounStore.open(path)
+    >>> store.root
+    ((4, 5), (6, (14, 15)))
+    >>> tar((store.root, (0, 7)))
+    (14, 15)
+    >>> tar((store.root, (5, (0, 1), (1, 5))))
+    1
+    >>> store.root[1] == 6, 6 == store.root[1], store.root == (4, 5)
+    (False, False, False)
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(store.root[1])) == (6, (14, 15))
+    True
+    >>> os.remove(path)
+
+    Stored cells are new objects on every access, but the noun walkers still
+    see each one once:
+
+    >>> noun = compact(_t(*[(i % 7, (i, 0)) for i in range(50)]))
+    >>> NounStore.write(noun, path)
+    >>> root = NounStore.open(path).root
+    >>> size(root)[:3] == size(noun)[:3]
+    True
+    >>> compact(root) == noun, prepare(root).digest == prepare(noun).digest
+    (True, True)
+    >>> os.remove(path)
+    """
+
+    def __init__(self, buf, path=None):
+        magic, version, root = _HEADER.unpack_from(buf, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError("Not a version %s noun store." % STORE_VERSION)
+        self.buf = buf
+        self.path = path
+        self.root = self._noun(root)
+
+    @classmethod
+    def open(cls, path):
+        """Map the store in the given file, or return it if already open.
+
+        A file that has been replaced since it was mapped is mapped afresh;
+        cells from the old mapping still read the old file.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        if path not in _STORES or _STORES[path][0] != (st.st_dev, st.st_ino):
+            with open(path, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _STORES[path] = (st.st_dev, st.st_ino), cls(buf, path)
+        return _STORES[path][1]
+
+    @staticmethod
+    def dumps(noun):
+        """Serialize a noun into a store buffer.
+        """
+        out = [None]
+        offsets = {}
+        pos = [_HEADER.size]
+
+        def emit(record):
+            out.append(record)
+            pos[0] += len(record)
+
+        def ref(n):
+            key = n if isinstance(n, ATOM) else (id(n),)
+            if key not in offsets:
+                offsets[key] = pos[0]
+                raw = uncord(n)
+                emit(_ATOM.pack('a', len(raw)) + raw)
+            return offsets[key]
+
+        noun = compact(_aorc(noun))
+        for cell in _cells(noun):
+            h, t = ref(cell[0]), ref(cell[1])
+            offsets[(id(cell),)] = pos[0]
+            emit(_CELL.pack('c', h, t))
+        out[0] = _HEADER.pack(STORE_MAGIC, STORE_VERSION, ref(noun))
+        return b''.join(out)
+
+    @classmethod
+    def write(cls, noun, path):
+        """Serialize a noun into a store file.
+
+        The file is written aside and renamed into place, so processes that
+        have the old file mapped keep reading it undisturbed.
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(cls.dumps(noun))
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def _noun(self, offset):
+        tag, length = _ATOM.unpack_from(self.buf, offset)
+        if tag == 'c':
+            return StoredCell(self, offset)
+        start = offset + _ATOM.size
+        return cord(self.buf[start:start + length])
+
+
+### PREPARED FORMULAS
+#####################
+"""
+Before we run a formula, we can learn a few things about it once and for all:
+we compact it, so repeated sub-formulas are shared, and we note which
+opcodes it can reach, so that callers can pick a suitable engine. We key all
+of this by a hash of the formula's structure, which is cheap to compute over
+a shared DAG and identical in every process.
+"""
+Prepared = collections.namedtuple('Prepared', 'formula ops digest')
+
+# Bits of `Prepared.ops` beyond the opcodes themselves.
+OPS_CELL = 1 << 11  # line 19 autocons
+OPS_BAD = 1 << 12   # something that can't be a formula at all
+
+
+def _hash(noun, digests=None):
+    """Return a hex digest of a noun's structure.
+
+    `digests` may carry raw digests, by cell key, from one call to the next;
+    the caller must keep those cells alive.
+
+    >>> _hash((1, 2)) == _hash(_t(1, 2)) != _hash((2, 1))
+    True
+    """
+    def atom(a):
+        return hashlib.sha1('a' + uncord(a)).digest()
+
+    digests = {} if digests is None else digests
+    for cell in _cells(noun, digests):
+        h, t = [digests[_key(c)] if _key(c) in digests else atom(c) for c in cell]
+        digests[_key(cell)] = hashlib.sha1('c' + h + t).digest()
+    digest = digests[_key(noun)] if _key(noun) in digests else atom(noun)
+    return binascii.hexlify(digest)
+
+
+def _analyze(formula):
+    """Return the `Prepared.ops` bitmask for a formula.
+
+    >>> bin(_analyze(_t(6, (3, 0, 1), (4, 0, 1), (1, 233))))
+    '0b1011011'
+    >>> _analyze(_t((4, 0, 1), (1, 2))) == OPS_CELL | 1 << 4 | 1 << 1 | 1
+    True
+    >>> _analyze(42) == OPS_BAD
+    True
+    """
+    mask = 0
+    seen = set()
+    stack = [formula]
+    while stack:
+        f = stack.pop()
+        if _key(f) in seen:
+            continue
+        seen.add(_key(f))
+        if isinstance(f, ATOM):
+            mask |= OPS_BAD
+            continue
+        op, obj = f
+        if not isinstance(op, ATOM):
+            mask |= OPS_CELL
+            stack.extend(f)
+            continue
+        mask |= (1 << op) if op <= OP_H10 else OPS_BAD
+        try:
+            if op == OP_TAR or op == OP_H07 or op == OP_H08:
+                stack.extend(obj)
+            elif op in (OP_WUT, OP_LUS, OP_TIS):
+                stack.append(obj)
+            elif op == OP_IF:
+                stack.append(obj[0])
+                stack.extend(obj[1])
+            elif op == OP_H09:
+                stack.append(obj[1])
+            elif op == OP_H10:
+                if not isinstance(obj[0], ATOM):
+                    stack.append(obj[0][1])
+                stack.append(obj[1])
+        except (TypeError, ValueError):
+            mask |= OPS_BAD
+    return mask
+
+
+def prepare(formula):
+    """Prepare a formula.
+
+    >>> prepare((6, (1, 0), (4, 0, 1), (1, 233)))  # doctest: +ELLIPSIS
+    Prepared(formula=(6, ((1, 0), ((4, (0, 1)), (1, 233)))), ops=83, digest='...')
+    """
+    formula = compact(_aorc(formula))
+    return Prepared(formula, _analyze(formula), _hash(formula))
+
+
+### BATCHES, for running one small formula over many small subjects.
+###################################################################
+"""
+A formula built only from `0`, `1`, `3`, `4`, `5`, `6` and autocons never
+makes up new code as it goes, so its whole path through the interpreter is
+known in advance. Given NumPy, we can walk that path once for a whole array
+of subjects: a subject becomes a tree of columns, one `uint64` array per atom
+slot, `4` becomes an array increment, `5` an elementwise comparison, and `6` a
+masked select between both branches.
+
+Whenever a batch strays outside what the columns can say -- subjects of
+different shapes, atoms of 64 bits or more, an increment that would overflow,
+a crash, a test that isn't a loobean -- we give up on the batch and reduce
+each subject the ordinary way instead, so the products are always those of
+`tar`.
+"""
+BATCH_OPS = OPS_CELL | sum(1 << op for op in (OP_FAS, OP_CON, OP_WUT, OP_LUS, OP_TIS, OP_IF))
+
+
+class _Scalar(Exception):
+    """Raised to abandon a batch in favour of the scalar interpreter.
+    """
+
+
+class _Const(object):
+    """A noun that is the same for every subject in a batch.
+    """
+    __slots__ = ('noun',)
+
+    def __init__(self, noun):
+        self.noun = noun
+
+
+def _columns(rows):
+    """Return the column tree for a list of same-shaped nouns.
+    """
+    if all(isinstance(r, ATOM) for r in rows):
+        try:
+            return numpy.array(rows, dtype=numpy.uint64)
+        except OverflowError:
+            raise _Scalar()
+    elif any(isinstance(r, ATOM) for r in rows):
+        raise _Scalar()
+    return (_columns([r[0] for r in rows]), _columns([r[1] for r in rows]))
+
+
+def _rows(col, n):
+    """Return the list of nouns in a column tree.
+    """
+    if isinstance(col, _Const):
+        return [col.noun] * n
+    elif isinstance(col, tuple):
+        return zip(_rows(col[0], n), _rows(col[1], n))
+    return [int(a) for a in col.tolist()]
+
+
+def _vfas(axis, col):
+    """/[axis col] over a column tree.
+    """
+    if not isinstance(axis, ATOM) or axis == 0:
+        raise _Scalar()
+    for bit in bin(axis)[3:]:
+        if isinstance(col, _Const):
+            if isinstance(col.noun, ATOM):
+                raise _Scalar()
+            col = _Const(col.noun[int(bit)])
+        elif isinstance(col, tuple):
+            col = col[int(bit)]
+        else:
+            raise _Scalar()
+    return col
+
+
+def _vatoms(col, n):
+    """Return a column tree's atoms as an array, broadcasting constants.
+    """
+    if isinstance(col, _Const):
+        if not isinstance(col.noun, ATOM) or col.noun >= 2 ** 64:
+            raise _Scalar()
+        return numpy.full(n, col.noun, dtype=numpy.uint64)
+    elif isinstance(col, tuple):
+        raise _Scalar()
+    return col
+
+
+def _veq(a, b):
+    """Compare two column trees: a bool, or an array of them.
+    """
+    if isinstance(a, _Const) and isinstance(b, _Const):
+        return a.noun == b.noun
+    if isinstance(b, _Const):
+        a, b = b, a
+    if isinstance(a, _Const):
+        if isinstance(a.noun, ATOM):
+            if isinstance(b, tuple) or a.noun >= 2 ** 64:
+                return False
+            return b == a.noun
+        elif not isinstance(b, tuple):
+            return False
+        a = (_Const(a.noun[0]), _Const(a.noun[1]))
+    if isinstance(a, tuple) != isinstance(b, tuple):
+        return False
+    elif not isinstance(a, tuple):
+        return a == b
+    h = _veq(a[0], b[0])
+    if h is False:
+        return False
+    t = _veq(a[1], b[1])
+    return t if h is True else (h if t is True else h & t)
+
+
+def _vwhere(mask, c, d, n):
+    """Select, row by row, from `c` where `mask` is set and `d` elsewhere.
+    """
+    if isinstance(c, tuple) or isinstance(d, tuple):
+        if isinstance(c, _Const) and not isinstance(c.noun, ATOM):
+            c = (_Const(c.noun[0]), _Const(c.noun[1]))
+        if isinstance(d, _Const) and not isinstance(d.noun, ATOM):
+            d = (_Const(d.noun[0]), _Const(d.noun[1]))
+        if not (isinstance(c, tuple) and isinstance(d, tuple)):
+            raise _Scalar()
+        return (_vwhere(mask, c[0], d[0], n), _vwhere(mask, c[1], d[1], n))
+    return numpy.where(mask, _vatoms(c, n), _vatoms(d, n))
+
+
+def _vtar(col, formula, n):
+    """*[col formula] over a column tree of `n` subjects.
+    """
+    op, obj = formula
+    if not isinstance(op, ATOM):
+        return (_vtar(col, op, n), _vtar(col, obj, n))
+
+    elif op == OP_FAS:
+        return _vfas(obj, col)
+
+    elif op == OP_CON:
+        return _Const(obj)
+
+    elif op == OP_WUT:
+        v = _vtar(col, obj, n)
+        if isinstance(v, _Const):
+            return _Const(_wut(v.noun))
+        return _Const(YES if isinstance(v, tuple) else NO)
+
+    elif op == OP_LUS:
+        v = _vtar(col, obj, n)
+        if isinstance(v, _Const) and isinstance(v.noun, ATOM):
+            return _Const(v.noun + 1)
+        elif isinstance(v, numpy.ndarray) and not (v == 2 ** 64 - 1).any():
+            return v + numpy.uint64(1)
+        raise _Scalar()
+
+    elif op == OP_TIS:
+        v = _vtar(col, obj, n)
+        if isinstance(v, _Const) and not isinstance(v.noun, ATOM):
+            return _Const(_tis(v.noun))
+        elif not isinstance(v, tuple):
+            raise _Scalar()
+        eq = _veq(*v)
+        if isinstance(eq, bool):
+            return _Const(YES if eq else NO)
+        return numpy.where(eq, YES, NO).astype(numpy.uint64)
+
+    elif op == OP_IF:
+        b, (c, d) = obj
+        test = _vtar(col, b, n)
+        if isinstance(test, _Const):
+            if test.noun == YES:
+                return _vtar(col, c, n)
+            elif test.noun == NO:
+                return _vtar(col, d, n)
+        elif isinstance(test, numpy.ndarray) and not (test > NO).any():
+            mask = test == YES
+            if mask.all():
+                return _vtar(col, c, n)
+            elif not mask.any():
+                return _vtar(col, d, n)
+            return _vwhere(mask, _vtar(col, c, n), _vtar(col, d, n), n)
+
+    raise _Scalar()
+
+
+def tar_batch(subjects, formula):
+    """Reduce the same formula against each of a list of subjects.
+
+    Uses NumPy, when it's around and the formula allows; the products are the
+    same either way.
+
+    >>> tar_batch([1, 2, 3], (4, 0, 1))
+    [2, 3, 4]
+    >>> tar_batch([(1, 1), (1, 2)], ((5, 0, 1), (4, 0, 3)))
+    [(0, 2), (1, 3)]
+    >>> tar_batch([0, 1, 2], (6, (5, (0, 1), (1, 1)), (1, 10), (4, 0, 1)))
+    [1, 10, 3]
+    >>> tar_batch([2 ** 64 - 1, 7], (4, 0, 1)) == [2 ** 64, 8]
+    True
+    """
+    prepared = prepare(formula)
+    return _tar_columns(list(subjects), prepared.formula, prepared.ops)
+
+
+def _tar_columns(subjects, formula, ops):
+    """Reduce a formula, whose `Prepared.ops` are given, against each subject.
+    """
+    global BATCHED
+    if numpy is not None and subjects and not ops & ~BATCH_OPS:
+        try:
+            products = _rows(_vtar(_columns(subjects), formula, len(subjects)), len(subjects))
+            BATCHED += 1
+            return products
+        except (_Scalar, TypeError, ValueError):
+            pass
+    return [tar((subject, formula)) for subject in subjects]
+
+
+class NockCrash(Exception):
+    """Nock crashed, or would never terminate.
+
+    `frames` lists the reductions the crash passed through, innermost first,
+    as (spec line, label) pairs.
+    """
+
+    def __init__(self, message, frames=None):
+        Exception.__init__(self, message, frames)
+        self.frames = frames if frames is not None else []
+
+    def __str__(self):
+        trace = ' <- '.join(('%s %s' % f) if f[1] else str(f[0]) for f in self.frames)
+        return '%s [%s]' % (self.args[0], trace) if trace else self.args[0]
+
+
+STRICT = False
+
+
+def strict(on=True):
+    """Switch strict mode on (or off).
+
+    In strict mode, Nock crashes as soon as a reduction goes wrong, rather than
+    carrying on with nonsense. The crash says where it happened:
+
+    >>> strict()
+    >>> tar((42, (4, 0, 2)))
+    Traceback (most recent call last):
+        ...
+    NockCrash: /[2 42]: an atom has no head [21 /2 <- 25]
+    >>> tar(42)
+    Traceback (most recent call last):
+        ...
+    NockCrash: *42 never terminates [35]
+    >>> tar((42, (10, (1953718630, (1, 0)), (11, 0))))
+    Traceback (most recent call last):
+        ...
+    NockCrash: *[a 11 b] never terminates: no such opcode [35 <- 23 <- 29 <- 23 <- 29 <- 30 <- 32 %fast]
+    >>> tar((42, (9, 5)))
+    Traceback (most recent call last):
+        ...
+    NockCrash: /[2 5]: an atom has no head [31]
+    >>> tar((42, (10, 5)))
+    Traceback (most recent call last):
+        ...
+    NockCrash: /[2 5]: an atom has no head [32]
+    >>> strict(False)
+    """
+    global STRICT
+    STRICT = on
+
+
 ### The PARSER
 ##################
 TOKENS_CP = re.compile(r'\[|\]|[0-9]+|[*?=/+]')
@@ -821,8 +1885,40 @@ OPS = {
 }
 
 
+class Expr(object):
+    """An operator applied to a (possibly unevaluated) noun, as parsed.
+    """
+    __slots__ = ('op', 'arg')
+
+    def __init__(self, op, arg):
+        self.op = op
+        self.arg = arg
+
+    def __eq__(self, other):
+        return isinstance(other, Expr) and (self.op, self.arg) == (other.op, other.arg)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Expr(%r, %r)' % (self.op, self.arg)
+
+
+def _constant(tree):
+    """Is this parse tree just a noun, with nothing left to evaluate?
+    """
+    if isinstance(tree, Expr):
+        return False
+    elif isinstance(tree, tuple):
+        return all(_constant(t) for t in tree)
+    return True
+
+
 def _construct(tk_iter, token):
-    """Construct and reduce Nock sub-expressions.
+    """Construct Nock sub-expressions.
+
+    Constant arguments are structured as nouns up front, and the formula of a
+    constant `*[a b]` is compacted, so there is nothing left to do but reduce.
     """
     if token == '[':
         out = []
@@ -833,7 +1929,12 @@ def _construct(tk_iter, token):
 
         return tuple(out)
     if token in OPS:
-        return OPS[token](_construct(tk_iter, tk_iter.next()))
+        arg = _construct(tk_iter, tk_iter.next())
+        if _constant(arg):
+            arg = _aorc(arg)
+            if token == '*' and not isinstance(arg, ATOM):
+                arg = (arg[0], compact(arg[1]))
+        return Expr(token, arg)
     elif token[0] in NUMBERS:
         return int(token)
 
@@ -843,25 +1944,698 @@ def _construct(tk_iter, token):
 def parse(s):
     """Nock parser.
 
-    Based on effbot's `iterator-based parser`_.
+    Based on effbot's `iterator-based parser`_. Operators are not applied
+    here; see `evaluate`.
+
+    >>> parse('[*[42 4 0 1] 7]')
+    (Expr('*', (42, (4, (0, 1)))), 7)
+    >>> parse('*[42')
+    Traceback (most recent call last):
+        ...
+    SyntaxError: Malformed Nock expression.
 
     .. _iterator-based parser: http://effbot.org/zone/simple-iterator-parser.htm
     """
     tokens = iter(TOKENS_CP.findall(s))
-    return _construct(tokens, tokens.next())
+    try:
+        return _construct(tokens, tokens.next())
+    except StopIteration:
+        raise SyntaxError("Malformed Nock expression.")
+
+
+def evaluate(tree, engine='tar'):
+    """Apply the operators in a parse tree, reducing `*` with the named engine.
+
+    >>> evaluate(parse('[*[42 4 0 1] +7 =[1 1]]'))
+    (43, 8, 0)
+    """
+    if isinstance(tree, Expr):
+        op = ENGINES[engine] if tree.op == '*' else OPS[tree.op]
+        return op(evaluate(tree.arg, engine))
+    elif isinstance(tree, tuple):
+        return tuple(evaluate(t, engine) for t in tree)
+    return tree
+
+
+PARSE_CACHE_SIZE = 1024
+_PARSED = collections.OrderedDict()
+
+
+def _parsed(s):
+    """Return the parse tree for an expression, from the cache if we can.
+
+    The cache keeps the `PARSE_CACHE_SIZE` most recently used expressions.
+
+    >>> _parsed('*[42 4 0 1]') is _parsed('*[42 4 0 1]')
+    True
+    """
+    try:
+        tree = _PARSED.pop(s)
+    except KeyError:
+        tree = parse(s)
+        while len(_PARSED) >= PARSE_CACHE_SIZE:
+            _PARSED.popitem(last=False)
+    _PARSED[s] = tree
+    return tree
+
+
+### TRACES, for reading reductions after the fact.
+#################################################
+"""
+The debug log is lovely to read and hopeless to analyze. A recorder instead
+writes each reduction as a compact binary event -- which line of the spec
+fired, at what depth, against which subject and formula -- and defines each
+noun piecewise, the first time it appears: a new subject that differs from an
+old one by a single push costs a single new cell. `replay` turns a recording
+back into the familiar indented trace, and `diff_traces` finds where two
+recordings part ways.
+
+The stream is `NKTR` and a version byte, then records:
+
+    'A' <length:varint> <bytes>                     the next noun, an atom
+    'C' <head:varint> <tail:varint>                 the next noun, a cell
+    'N' <digest:20>                                 the next noun, unseen
+    'E' <line:B> <depth:varint> <subject:varint> <formula:varint>
+
+where nouns are numbered from 0 in the order they're defined, and a cell's
+head and tail are always defined before it. Readers name nouns by their
+`_hash`, which they can work out from the definitions. Without `nouns`, only
+the hashes of subjects and formulas are written, as `N` records, and replays
+show digests instead.
+"""
+TRACE_MAGIC = b'NKTR'
+TRACE_VERSION = 2
+Event = collections.namedtuple('Event', 'line depth subject formula')
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append(0x80 | (n & 0x7f))
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(f):
+    n = shift = 0
+    while True:
+        byte = ord(f.read(1))
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return n
+
+
+class Recorder(object):
+    """Write reduction events to a binary trace file.
+    """
+
+    def __init__(self, f, nouns=True):
+        self.f = f
+        self.nouns = nouns
+        self.atoms = {}    # atom -> index
+        self.pairs = {}    # (head index, tail index) -> index
+        self.cells = {}    # cell key -> index, for cells we've met
+        self.digests = {}
+        self.pinned = []
+        self.defined = 0
+        f.write(TRACE_MAGIC + chr(TRACE_VERSION))
+
+    def _define(self, record):
+        self.f.write(record)
+        self.defined += 1
+        return self.defined - 1
+
+    def _atom(self, atom):
+        if atom not in self.atoms:
+            data = uncord(atom)
+            self.atoms[atom] = self._define('A' + _varint(len(data)) + data)
+        return self.atoms[atom]
+
+    def _index(self, noun):
+        return self._atom(noun) if isinstance(noun, ATOM) else self.cells[_key(noun)]
+
+    def _ref(self, noun):
+        if isinstance(noun, ATOM) and self.nouns:
+            return self._atom(noun)
+        elif _key(noun) not in self.cells:
+            self.pinned.append(noun)
+            if not self.nouns:
+                digest = binascii.unhexlify(_hash(noun, self.digests))
+                if digest not in self.pairs:
+                    self.pairs[digest] = self._define('N' + digest)
+                self.cells[_key(noun)] = self.pairs[digest]
+            else:
+                for cell in _cells(noun, self.cells):
+                    pair = self._index(cell[0]), self._index(cell[1])
+                    if pair not in self.pairs:
+                        self.pairs[pair] = self._define('C' + _varint(pair[0]) + _varint(pair[1]))
+                    self.cells[_key(cell)] = self.pairs[pair]
+        return self.cells[_key(noun)]
+
+    def record(self, line, depth, subj, formula):
+        s, f = self._ref(subj), self._ref(formula)
+        self.f.write('E' + chr(line) + _varint(depth) + _varint(s) + _varint(f))
+
+
+@contextlib.contextmanager
+def recording(path, nouns=True):
+    """Context manager to record every reduction made within it to a file.
+
+    >>> path = tempfile.mktemp()
+    >>> with recording(path):
+    ...     tar((42, (4, 0, 1)))
+    43
+    >>> replay(path)
+    *[42 [4 [0 1]]]
+     <- 25 ::    *[a 4 b]          +*[a b]
+     *[42 [0 1]]
+      <- 21 ::    *[a 0 b]          /[b a]
+
+    Pushing onto a subject defines only what's new, so each push costs a few
+    cells, however big the subject is:
+
+    >>> big = tape('x' * 400)
+    >>> pushes = reduce(lambda f, _: (8, ((1, 0), f)), range(30), (0, 1))
+    >>> with recording(path):
+    ...     _ = tar((big, pushes))
+    >>> defined = sum(1 for e in _events(path) if not isinstance(e, Event))
+    >>> defined < size(big).cells + 10 * 30
+    True
+    >>> os.remove(path)
+    """
+    global RECORDER
+    with open(path, 'wb') as f:
+        RECORDER = Recorder(f, nouns)
+        try:
+            yield RECORDER
+        finally:
+            RECORDER = None
+
+
+def _events(path):
+    """Yield the events in a trace file, with nouns named by hex digest.
+
+    Also yields each noun's definition, as a `(digest, noun-or-None)` pair.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC) + 1) != TRACE_MAGIC + chr(TRACE_VERSION):
+            raise ValueError("Not a version %s trace: %s" % (TRACE_VERSION, path))
+        digests = []
+        nouns = []
+        while True:
+            kind = f.read(1)
+            if not kind:
+                break
+            elif kind == 'A':
+                data = f.read(_read_varint(f))
+                digests.append(hashlib.sha1('a' + data).digest())
+                nouns.append(cord(data))
+            elif kind == 'C':
+                h, t = _read_varint(f), _read_varint(f)
+                digests.append(hashlib.sha1('c' + digests[h] + digests[t]).digest())
+                nouns.append((nouns[h], nouns[t]))
+            elif kind == 'N':
+                digests.append(f.read(20))
+                nouns.append(None)
+            elif kind == 'E':
+                line = ord(f.read(1))
+                depth = _read_varint(f)
+                s, t = _read_varint(f), _read_varint(f)
+                yield Event(line, depth, binascii.hexlify(digests[s]),
+                            binascii.hexlify(digests[t]))
+                continue
+            else:
+                raise ValueError("Corrupt trace: %s" % path)
+            yield binascii.hexlify(digests[-1]), nouns[-1]
+
+
+def _render(event, nouns):
+    """Return the trace lines for an event.
+    """
+    s, f = nouns.get(event.subject), nouns.get(event.formula)
+    if s is None or f is None:
+        reduction = '*[#%s #%s]' % (event.subject[:8], event.formula[:8])
+    else:
+        reduction = '*' + _r((s, f))
+    return [' ' * (event.depth - 1) + reduction,
+            ' ' * event.depth + '<- ' + SPEC[event.line]]
+
+
+def _only_events(path, nouns):
+    """Yield the events in a trace file, collecting its nouns as we go.
+    """
+    for event in _events(path):
+        if isinstance(event, Event):
+            yield event
+        else:
+            nouns[event[0]] = event[1]
+
+
+def replay(path, out=None):
+    """Write out a recorded trace in the style of the debug log.
+    """
+    out = out or sys.stdout
+    nouns = {}
+    for event in _only_events(path, nouns):
+        out.write('\n'.join(_render(event, nouns)) + '\n')
+
+
+def diff_traces(a, b, out=None):
+    """Compare two recorded traces, and describe their first difference.
+
+    Returns the index of the first differing event, or None if they match.
+
+    >>> a, b = tempfile.mktemp(), tempfile.mktemp()
+    >>> with recording(a):
+    ...     tar((42, (6, (1, 0), (4, 0, 1), (1, 233))))
+    43
+    >>> with recording(b):
+    ...     tar((42, (6, (1, 0), (4, 0, 1), (1, 233))))
+    43
+    >>> diff_traces(a, b) is None
+    True
+    >>> with recording(b):
+    ...     tar((42, (6, (1, 1), (4, 0, 1), (1, 233))))
+    233
+    >>> diff_traces(a, b, out=open(os.devnull, 'w'))
+    0
+    >>> os.remove(a); os.remove(b)
+    """
+    import itertools
+    out = out or sys.stdout
+    nouns = ({}, {})
+    streams = [_only_events(a, nouns[0]), _only_events(b, nouns[1])]
+    for i, (x, y) in enumerate(itertools.izip_longest(*streams)):
+        if x != y:
+            out.write('Traces differ at event %s:\n' % i)
+            for path, event, n in ((a, x, nouns[0]), (b, y, nouns[1])):
+                out.write('--- %s\n' % path)
+                out.write('\n'.join(_render(event, n)) + '\n' if event else '(end of trace)\n')
+            return i
+    return None
+
+
+### JETS, and keeping them honest.
+##################################
+"""
+A jet is native code that we trust to compute the same product as some
+formula, only faster. Here, a jet is any Python function of the subject,
+registered against the exact formula it replaces.
+
+Trust, but verify: each jet can have a sample rate, and that fraction of its
+calls is also reduced the slow way, in a background process, without holding
+up the caller. Any disagreement is logged and kept, subject and all, for
+`verified()` to report.
+"""
+JETS = {}
+Mismatch = collections.namedtuple('Mismatch', 'name subject jet nock')
+MISMATCHES = []
+_SHADOW = {'pool': None, 'pending': []}
+
+
+class Jet(object):
+    """A native stand-in for a formula.
+    """
+
+    def __init__(self, name, formula, func, sample=0.0):
+        self.name = name
+        self.formula = formula
+        self.func = func
+        self.sample = sample
+
+    def __call__(self, subj):
+        _d("<- jet %s", self.name)
+        product = self.func(subj)
+        if self.sample and random.random() < self.sample:
+            _shadow(self, subj, product)
+        return product
+
+
+def jet(formula, name=None, sample=0.0):
+    """Decorator to register a function of the subject as a jet for a formula.
+
+    `sample` is the fraction of calls to check against plain Nock.
+
+    >>> @jet((4, 0, 1), sample=1.0)
+    ... def inc(subj):
+    ...     return subj + 2
+    >>> tar((41, (4, 0, 1)))
+    43
+    >>> verified()
+    [Mismatch(name='inc', subject=41, jet=43, nock=42)]
+    >>> del JETS[(4, (0, 1))], MISMATCHES[:]
+    """
+    def register(func):
+        f = _aorc(formula)
+        JETS[f] = Jet(name or func.__name__, f, func, sample)
+        return func
+    return register
+
+
+def _shadow_init():
+    """Set up a shadow worker to reduce plain Nock, whatever its parent was up to.
+    """
+    global PARALLEL, RECORDER
+    JETS.clear()
+    PARALLEL = None
+    RECORDER = None
+    logger.setLevel(DEFAULT_LEVEL)
+
+
+def _shadow_check(name, subj, formula, product, strict_on):
+    """Reduce a jetted call the slow way; return a `Mismatch`, if any.
+
+    `strict_on` is the parent's strict mode at the time of the call.
+    """
+    global STRICT
+    STRICT = strict_on
+    try:
+        expected = _tar((subj, formula))
+    except Exception as e:
+        expected = '%s: %s' % (type(e).__name__, e)
+    if expected != product:
+        return Mismatch(name, subj, product, expected)
+
+
+def _shadow_report(mismatch):
+    """Log and keep a mismatch found by a shadow worker, if any.
+    """
+    if mismatch is not None:
+        logger.warning("Jet %s disagrees with Nock on %s: %s != %s", mismatch.name,
+                       _r(mismatch.subject), _r(mismatch.jet), mismatch.nock)
+        MISMATCHES.append(mismatch)
+
+
+def _shadow(j, subj, product):
+    """Queue a jetted call for verification in the background.
+    """
+    import multiprocessing
+    if _SHADOW['pool'] is None:
+        _SHADOW['pool'] = multiprocessing.Pool(1, _shadow_init)
+    pending = _SHADOW['pending'] = [p for p in _SHADOW['pending'] if not p.ready()]
+    pending.append(_SHADOW['pool'].apply_async(
+        _shadow_check, (j.name, subj, j.formula, product, STRICT), callback=_shadow_report))
+
 
+def verified():
+    """Wait for any pending jet checks, and return the mismatches found so far.
+    """
+    for p in _SHADOW['pending']:
+        p.wait()
+    _SHADOW['pending'] = []
+    return list(MISMATCHES)
+
+
+### PARALLEL AUTOCONS, for idle cores.
+######################################
+"""
+The two halves of line 19 are independent, so when both are expensive we can
+reduce them at the same time, in a process pool. How expensive is a formula?
+We guess from last time: every autocons reduced the ordinary way records how
+many reductions each half took, and once both halves of a pair have cost at
+least `threshold`, later pairs with those halves run in parallel.
+
+The products are the same either way, and so are the crashes: the head is
+joined first, so its error wins, and each worker gets exactly the stack
+headroom the sequential reduction would have had. Each job also carries the
+current strict mode and jets, so switching either after the pool has started
+still counts; jets that can't be pickled keep autocons sequential. Tracing and
+recording happen in this process only, so either one keeps autocons
+sequential too, and jets in the workers don't sample.
+"""
+PARALLEL = None
+
+
+def _headroom():
+    """Return how many more nested calls the caller has room for.
+    """
+    def probe(n):
+        try:
+            return probe(n + 1)
+        except RuntimeError:
+            return n
+    return probe(0)
+
+
+def _parallel_init():
+    """Set up a parallel worker; only its parent traces and records.
+    """
+    global PARALLEL, RECORDER
+    PARALLEL = None
+    RECORDER = None
+    logger.setLevel(DEFAULT_LEVEL)
+
+
+_WORKER_JETS = [None]
+
+
+def _parallel_run(noun, headroom, mode):
+    """Reduce a noun in a worker, with the given stack headroom.
+
+    `mode` is the parent's strict mode and pickled jets, as `(strict, jets)`,
+    since either may have changed since the worker was forked.
+
+    Returns the product and the number of reductions it took, or None if the
+    jets can't be loaded here.
+    """
+    import pickle
+    global REDUCTIONS, STRICT
+    STRICT, jets = mode
+    if jets != _WORKER_JETS[0]:
+        try:
+            jets = pickle.loads(jets)
+        except Exception:
+            return None
+        JETS.clear()
+        for name, formula, func in jets:
+            JETS[formula] = Jet(name, formula, func)
+        _WORKER_JETS[0] = mode[1]
+    REDUCTIONS = 0
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(limit + headroom - _headroom())
+    try:
+        return tar(noun), REDUCTIONS
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+class _Parallel(object):
+    """A parallel autocons mode: a process pool, and what each formula cost.
+    """
 
-def main():
-    import sys
+    def __init__(self, threshold, processes):
+        import multiprocessing
+        self.threshold = threshold
+        self.pool = multiprocessing.Pool(processes, _parallel_init)
+        self.costs = {}
+        self.dispatched = 0
+        self.jets = None, None
+
+    def _mode(self):
+        """Return the mode to run a job in, or None if the jets won't pickle.
+        """
+        import pickle
+        key = [(f, j.name, j.func) for f, j in JETS.iteritems()]
+        if key != self.jets[0]:
+            try:
+                jets = pickle.dumps([(name, f, func) for f, name, func in key],
+                                    pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                jets = None
+            self.jets = key, jets
+        return None if self.jets[1] is None else (STRICT, self.jets[1])
+
+    def _profile(self, subj, formula):
+        start = REDUCTIONS
+        product = tar((subj, formula))
+        self.costs[formula] = REDUCTIONS - start
+        return product
+
+    def autocons(self, subj, b, c):
+        """*[subj [b c]], in parallel if both halves look expensive.
+        """
+        global REDUCTIONS
+        mode = None
+        if not (self.costs.get(b, 0) < self.threshold or self.costs.get(c, 0) < self.threshold
+                or RECORDER is not None or logger.isEnabledFor(logging.DEBUG)):
+            mode = self._mode()
+        if mode is None:
+            return (self._profile(subj, b), self._profile(subj, c))
+        headroom = _headroom() - 1  # less the frame of `_profile`
+        jobs = [self.pool.apply_async(_parallel_run, ((subj, f), headroom, mode))
+                for f in (b, c)]
+        self.dispatched += 1
+        results = []
+        for job in jobs:
+            results.append(job.get())
+            if results[-1] is None:
+                self.dispatched -= 1
+                return (self._profile(subj, b), self._profile(subj, c))
+        for product, reductions in results:
+            REDUCTIONS += reductions
+        return tuple(product for product, _ in results)
+
+
+def parallel(on=True, threshold=1000, processes=None):
+    """Switch parallel autocons on (or off).
+
+    `threshold` is the number of reductions each half must have cost before
+    it is worth farming out; `processes` defaults to the number of CPUs.
+    Returns the new mode, which counts the pairs it has `dispatched`.
+
+    >>> big = _t(4, 4, 4, 4, 4, 4, 0, 1)
+    >>> p = parallel(threshold=5, processes=2)
+    >>> tar((0, (big, big)))
+    (6, 6)
+    >>> tar((0, (big, big))), p.dispatched
+    ((6, 6), 1)
+
+    Workers crash just as this process would, in the mode it's in now:
+
+    >>> bad = _t(4, 4, 4, 4, 4, 4, 0, 2)
+    >>> tar((0, (bad, bad)))
+    (6, 6)
+    >>> strict()
+    >>> tar((0, (bad, bad)))  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    NockCrash: /[2 0]: an atom has no head ...
+    >>> strict(False)
+    >>> p.dispatched
+    2
+    >>> parallel(False)
+    """
+    global PARALLEL
+    if PARALLEL is not None:
+        PARALLEL.pool.terminate()
+    PARALLEL = _Parallel(threshold, processes) if on else None
+    return PARALLEL
+
+
+### TIMING, for when you want to know how slow it really is.
+###########################################################
+def _tar_batch(noun):
+    """*[a b], by way of the batch engine.
+    """
+    subj, formula = _t(*noun)
+    return tar_batch([subj], formula)[0]
+
+
+def _tar_auto(noun):
+    """*[a b], by way of the fastest engine that can take it.
+
+    That's the batch engine when NumPy is around and the formula allows, and
+    `tar` otherwise, or whenever a trace or a recording wants every reduction.
+    """
+    if numpy is None or RECORDER is not None or logger.isEnabledFor(logging.DEBUG):
+        return tar(noun)
+    subj, formula = _t(*noun)
+    ops = _analyze(formula)
+    if ops & ~BATCH_OPS:
+        return tar((subj, formula))
+    return _tar_columns([subj], formula, ops)[0]
+
+
+def _tar_strict(noun):
+    """*[a b], in strict mode.
+    """
+    on = STRICT
+    strict()
+    try:
+        return tar(noun)
+    finally:
+        strict(on)
+
+
+ENGINES = collections.OrderedDict([
+    ('auto', _tar_auto),
+    ('tar', tar),
+    ('batch', _tar_batch),
+    ('strict', _tar_strict),
+])
+
+Timing = collections.namedtuple('Timing', 'product wall reductions depth peak_rss')
+
+
+@contextlib.contextmanager
+def _quiet():
+    """Context manager to switch tracing off for a while.
+    """
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def measure(expr, engine='auto'):
+    """Reduce a (cached) parsed expression with tracing off, and time it.
+
+    Returns a `Timing` of the product, the wall time in seconds, the number of
+    reductions, the deepest indentation the trace would have reached, and the
+    process's peak resident memory so far, in kilobytes. The batch engine
+    doesn't reduce one step at a time, so when it runs, reductions and depth
+    are None.
+
+    >>> measure('*[42 [6 [1 0] [4 0 1] [1 233]]]').product
+    43
+    >>> t = measure('*[42 [6 [1 0] [4 0 1] [1 233]]]', 'tar')
+    >>> t.product, t.reductions, t.depth
+    (43, 18, 15)
+    >>> t = measure('*[42 2 [0 1] [1 4 0 1]]', 'batch')  # `2` isn't batched
+    >>> t.product, t.reductions, t.depth
+    (43, 5, 4)
+    """
+    import resource
+    import time
+    global REDUCTIONS, PEAK_LEVEL
+    REDUCTIONS = 0
+    PEAK_LEVEL = DEBUG_LEVEL
+    batched = BATCHED
+    with _quiet():
+        start = time.time()
+        product = evaluate(_parsed(expr), engine)
+        wall = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if BATCHED != batched:
+        return Timing(product, wall, None, None, rss)
+    return Timing(product, wall, REDUCTIONS, PEAK_LEVEL - DEBUG_LEVEL, rss)
+
+
+def _report(timings):
+    """Print a summary of one or more `Timing`s.
+    """
+    walls = [t.wall for t in timings]
+    t = timings[-1]
+    print _r(t.product)
+    if len(timings) == 1:
+        print "    %.6fs" % t.wall,
+    else:
+        print "    %d runs: min %.6fs, mean %.6fs, max %.6fs" % (
+            len(walls), min(walls), sum(walls) / len(walls), max(walls)),
+    if t.reductions is None:
+        print "| n/a reductions | peak depth n/a",
+    else:
+        print "| %d reductions | peak depth %d" % (t.reductions, t.depth),
+    print "| peak RSS %d KiB" % max(t.peak_rss for t in timings)
+    print
+
+
+def _repl():
     import readline
     readline.parse_and_bind('tab: complete')
-    logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+    logging.basicConfig(format='%(message)s')
 
     print "Welcome to Nock! (`:q` or ^D to quit; `:debug on` to enter debug mode)"
+    print "    (`:time <expr>`, `:bench N <expr>` and `:engine [name]` to measure things)"
     print "    (If you're totally confused, read http://www.urbit.org/2013/08/22/Chapter-2-nock.html)"
     print
     try:
         DEBUG = False
+        engine = 'auto'
         while True:
             line = raw_input('-> ').strip()
             if not line:
@@ -877,15 +2651,201 @@ def main():
                 else:
                     DEBUG = not DEBUG
 
-                debug()
+                debug(DEBUG)
+
+            elif line.startswith(':engine'):
+                name = line[len(':engine'):].strip()
+                if name in ENGINES:
+                    engine = name
+                elif name:
+                    print "No such engine: %s" % name
+                print "Engines: %s" % ' '.join(
+                    ('[%s]' if e == engine else '%s') % e for e in ENGINES)
+                print
+
+            elif line.startswith(':time '):
+                try:
+                    _report([measure(line[len(':time '):], engine)])
+                except Exception as e:
+                    print "!! %s: %s" % (type(e).__name__, e)
+                    print
+
+            elif line.startswith(':bench '):
+                n, _, expr = line[len(':bench '):].strip().partition(' ')
+                if not n.isdigit() or int(n) < 1:
+                    print "Usage: :bench N <expr>"
+                    print
+                    continue
+                try:
+                    _report([measure(expr, engine) for _ in xrange(int(n))])
+                except Exception as e:
+                    print "!! %s: %s" % (type(e).__name__, e)
+                    print
+
             else:
-                print _r(parse(line))
+                try:
+                    print _r(evaluate(_parsed(line), engine))
+                except Exception as e:
+                    print "!! %s: %s" % (type(e).__name__, e)
                 print
     except EOFError:
         pass
 
     print "Good-bye!"
     print
+
+
+### BATCH MODE, for when you have a million expressions and no patience.
+######################################################################
+"""
+Given files (or a pipe) instead of a terminal, `nock` reads one expression
+per record, reduces it, and writes one product per record, in order. Text
+records are lines; jam records are an 8-byte little-endian byte count
+followed by the bytes of a jammed `[subject formula]`, and products come back
+the same way. A record that crashes produces `!! <error>` in text mode, or an
+empty record in jam mode (no jammed noun is empty).
+
+With `-j N`, records are farmed out to N worker processes as they free up,
+never more than a fixed window ahead of the output, so memory stays bounded
+however long the input is.
+"""
+_FRAME = struct.Struct('<Q')
+
+
+def _records(files, read, mode):
+    """Yield the records read from each named file in turn (`-` is stdin).
+    """
+    for name in files:
+        if name == '-':
+            for record in read(sys.stdin):
+                yield record
+        else:
+            with open(name, mode) as f:
+                for record in read(f):
+                    yield record
+
+
+def _text_lines(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _jam_frames(f):
+    while True:
+        header = f.read(_FRAME.size)
+        if not header:
+            break
+        length, = _FRAME.unpack(header)
+        yield f.read(length)
+
+
+def _text_records(files):
+    return _records(files, _text_lines, 'r')
+
+
+def _jam_records(files):
+    return _records(files, _jam_frames, 'rb')
+
+
+def _run_text(line):
+    try:
+        return _r(evaluate(_parsed(line))) + '\n'
+    except Exception as e:
+        return '!! %s: %s\n' % (type(e).__name__, e)
+
+
+def _run_jam(record):
+    try:
+        product = uncord(jam(tar(cue(cord(record)))))
+    except Exception as e:
+        logger.warning('!! %s: %s', type(e).__name__, e)
+        product = ''
+    return _FRAME.pack(len(product)) + product
+
+
+def _batch(files, jobs=1, jammed=False, out=None):
+    """Reduce every record in the given files, writing products to `out`.
+
+    >>> import io
+    >>> path = tempfile.mktemp()
+    >>> with open(path, 'w') as f:
+    ...     f.write('*[42 4 0 1]\\n[1 2]\\n*[42 [4 0 1] [3 0 1]]\\n*[42 5 0 1]\\n')
+    >>> out = io.BytesIO()
+    >>> _batch([path], out=out)
+    >>> print out.getvalue(),
+    43
+    [1 2]
+    [43 1]
+    !! TypeError: 'int' object has no attribute '__getitem__'
+    >>> os.remove(path)
+    """
+    import itertools
+    out = out or sys.stdout
+    records = (_jam_records if jammed else _text_records)(files)
+    run = _run_jam if jammed else _run_text
+    if jobs <= 1:
+        for i, result in enumerate(itertools.imap(run, records), 1):
+            out.write(result)
+            if not i % 256:
+                out.flush()
+        out.flush()
+        return
+
+    import threading
+    import multiprocessing
+    window = 256 * jobs
+    room = threading.Semaphore(window)
+
+    def bounded(records):
+        # `imap` reads its input as fast as it can, so hold it to `window`
+        # records ahead of what has been written out.
+        for record in records:
+            room.acquire()
+            yield record
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for i, result in enumerate(pool.imap(run, bounded(records), 16), 1):
+            room.release()
+            out.write(result)
+            if not i % window:
+                out.flush()
+        out.flush()
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    pool.join()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='nock', description="Nock, Nock. Hoon's there?",
+        epilog="With no files and a terminal on stdin, start the interactive console.")
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        help="files of expressions to reduce, one per record ('-' for stdin)")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="reduce records across N worker processes")
+    parser.add_argument('--jam', action='store_true',
+                        help="read and write length-prefixed jammed nouns instead of text")
+    parser.add_argument('--replay', metavar='TRACE',
+                        help="print a recorded trace in the style of the debug log")
+    parser.add_argument('--diff', nargs=2, metavar='TRACE',
+                        help="show where two recorded traces first differ")
+    args = parser.parse_args(argv)
+    if args.replay:
+        replay(args.replay)
+    elif args.diff:
+        sys.exit(0 if diff_traces(*args.diff) is None else 1)
+    elif not args.files and sys.stdin.isatty():
+        _repl()
+    else:
+        logging.basicConfig(format='%(message)s')
+        _batch(args.files or ['-'], max(1, args.jobs), args.jam)
     sys.exit()
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@
 """
 import sys
 import os
+import re
 
 from setuptools import setup
 
@@ -10,7 +11,11 @@ TESTS_REQUIRE = [
     'nose',
 ]
 
-README = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'README.rst')
+HERE = os.path.abspath(os.path.dirname(__file__))
+README = os.path.join(HERE, 'README.rst')
+
+with open(os.path.join(HERE, 'nock.py')) as f:
+    VERSION = re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
 
 SETUP = dict(
     name = "nock",
@@ -23,7 +28,7 @@ SETUP = dict(
     },
     zip_safe = False,
 
-    version = "0.2.1",
+    version = VERSION,
     description = "Nock, Nock. Hoon's there?",
     long_description = open(README).read(),
     author = "David Eyk",